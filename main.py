@@ -1,33 +1,108 @@
 import streamlit as st
 import pandas as pd
-import openai
+import asyncio
+import hashlib
 import json
 import os
+import time
+from pathlib import Path
+import random
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, RateLimitError
 
 # -----------------------
 # Secure API Key Handling
 # -----------------------
-if "openai" in st.secrets and "api_key" in st.secrets["openai"]:
-    openai.api_key = st.secrets["openai"]["api_key"]
-else:
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key:
-        st.error("OpenAI API key not found. Please set it in .streamlit/secrets.toml or as an environment variable.")
-        st.stop()
-    openai.api_key = openai_api_key
+# Resolved once per process so secrets.toml is not re-parsed on every rerun.
+@st.cache_resource
+def get_api_key():
+    return st.secrets.get("openai", {}).get("api_key") or os.getenv("OPENAI_API_KEY")
+
+openai_api_key = get_api_key()
+if not openai_api_key:
+    # Don't pin the miss: Streamlit hot-reloads secrets.toml, so a fixed key
+    # should be picked up on the next rerun without a process restart.
+    get_api_key.clear()
+    st.error("OpenAI API key not found. Please set it in .streamlit/secrets.toml or as an environment variable.")
+    st.stop()
+
+# The client is created inside each generation's event loop rather than cached
+# across reruns: asyncio.run closes its loop after every click, and a cached
+# httpx.AsyncClient would keep pooled connections bound to that closed loop,
+# failing on the next click. HTTP/2 still multiplexes all of a batch's
+# concurrent calls over one connection, which is where the savings are.
+def _make_http_client():
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+    )
 
 # -----------------------
 # Cache Excel Data
 # -----------------------
+def _parse_sheets(filename, engine=None):
+    """
+    Parses only the columns each sheet actually uses: A-M of sheet1 (options
+    plus markers), the differentiators column of sheet2, and the imperative/
+    result pair of sheet3. Skipped columns never hit the parser.
+    If your header row is not the first row, adjust the header parameter here.
+    """
+    kwargs = {"engine": engine} if engine else {}
+    return {
+        0: pd.read_excel(filename, sheet_name=0, usecols="A:M", **kwargs),
+        1: pd.read_excel(filename, sheet_name=1, usecols=["Product Differentiators"], **kwargs),
+        2: pd.read_excel(filename, sheet_name=2, usecols=["Strategic Imperative", "Result"], **kwargs),
+    }
+
+def _optimize_dtypes(sheet1, sheet2, sheet3):
+    """
+    Downcasts the low-cardinality lookup columns: "Strategic Imperative" to
+    category (integer-code comparisons) and the "x"/blank marker cells in
+    sheet1 columns B-M to plain bool. Idempotent, so cached Parquet sheets
+    that were already converted pass through unchanged.
+    """
+    for df in (sheet1, sheet3):
+        if "Strategic Imperative" in df.columns:
+            df["Strategic Imperative"] = df["Strategic Imperative"].astype("category")
+    for col in sheet1.columns[1:13]:
+        if sheet1[col].dtype != bool:
+            sheet1[col] = sheet1[col].astype(str).str.strip().str.lower().eq('x')
+    return sheet1, sheet2, sheet3
+
 @st.cache_data
 def load_excel_data(filename):
     try:
-        excel_file = pd.ExcelFile(filename)
-        # If your header row is not the first row, adjust header parameter accordingly
-        sheet1 = excel_file.parse(excel_file.sheet_names[0])
-        sheet2 = excel_file.parse(excel_file.sheet_names[1])
-        sheet3 = excel_file.parse(excel_file.sheet_names[2])
-        return sheet1, sheet2, sheet3
+        # Disk cache: parsed sheets are stored as Parquet keyed by the workbook's
+        # hash, so fresh Streamlit processes skip the xlsx parser entirely.
+        # Invalidates automatically when the Excel file changes.
+        file_hash = hashlib.sha256(Path(filename).read_bytes()).hexdigest()[:16]
+        cache_dir = Path(".cache")
+        cache_paths = [cache_dir / f"{file_hash}_s{i}.parquet" for i in range(3)]
+        if all(p.exists() for p in cache_paths):
+            try:
+                return _optimize_dtypes(*(pd.read_parquet(p) for p in cache_paths))
+            except Exception:
+                # A corrupt or truncated cache file must not take the app down;
+                # drop the bad files and fall through to re-parsing the xlsx.
+                for path in cache_paths:
+                    path.unlink(missing_ok=True)
+
+        # The Rust-based calamine engine parses xlsx much faster than openpyxl;
+        # fall back to the default engine if python-calamine is not installed.
+        try:
+            sheets = _parse_sheets(filename, engine="calamine")
+        except ImportError:
+            sheets = _parse_sheets(filename)
+        sheets[0], sheets[1], sheets[2] = _optimize_dtypes(sheets[0], sheets[1], sheets[2])
+
+        try:
+            cache_dir.mkdir(exist_ok=True)
+            for i, path in enumerate(cache_paths):
+                sheets[i].to_parquet(path, compression="zstd")
+        except Exception:
+            pass  # the disk cache is best-effort; parsing already succeeded
+
+        return sheets[0], sheets[1], sheets[2]
     except Exception as e:
         st.error(f"Error reading the Excel file: {e}")
         return None, None, None
@@ -39,6 +114,36 @@ if sheet1 is None or sheet2 is None or sheet3 is None:
 # Debug: Print out the columns in Sheet1 to verify layout
 st.write("Sheet1 Columns:", sheet1.columns.tolist())
 
+# -----------------------
+# Precompute Filter Mask
+# -----------------------
+@st.cache_data
+def build_strategy_mask(df):
+    """
+    Slices out the marker columns B-M, already converted to bool at load time,
+    so filtering is reduced to bitwise ANDs on preallocated bool arrays.
+    """
+    return df.iloc[:, 1:13]
+
+mask_df = build_strategy_mask(sheet1)
+
+@st.cache_data
+def build_result_index(df):
+    """
+    Indexes sheet3 as {strategic imperative: [results...]} once at load time,
+    so the button handler does O(1) dict lookups instead of scanning the column.
+    """
+    if "Strategic Imperative" not in df.columns or "Result" not in df.columns:
+        return {}
+    return (
+        df.dropna(subset=["Strategic Imperative", "Result"])
+        .groupby("Strategic Imperative")["Result"]
+        .apply(list)
+        .to_dict()
+    )
+
+imp_to_results = build_result_index(sheet3)
+
 # -----------------------
 # Extract Options from Sheet1
 # -----------------------
@@ -55,60 +160,144 @@ if not role_options or not lifecycle_options or not journey_options:
 # -----------------------
 # Helper Functions
 # -----------------------
-def filter_strategic_imperatives(df, role, lifecycle, journey):
+@st.cache_data
+def filter_strategic_imperatives(role, lifecycle, journey):
     """
     Filters the strategic imperatives (in column "Strategic Imperative")
     where the corresponding cells in the given role, lifecycle, and journey columns contain an "x".
+    Memoized on the three selections so repeated widget toggles skip the filter.
     """
-    if role not in df.columns or lifecycle not in df.columns or journey not in df.columns:
+    if role not in mask_df.columns or lifecycle not in mask_df.columns or journey not in mask_df.columns:
         st.error("The Excel file’s columns do not match the expected names for filtering.")
         return []
-    
+
     try:
-        filtered = df[
-            (df[role].astype(str).str.lower() == 'x') &
-            (df[lifecycle].astype(str).str.lower() == 'x') &
-            (df[journey].astype(str).str.lower() == 'x')
-        ]
-        return filtered["Strategic Imperative"].dropna().tolist()
+        selected = mask_df[role] & mask_df[lifecycle] & mask_df[journey]
+        return sheet1.loc[selected, "Strategic Imperative"].dropna().tolist()
     except Exception as e:
         st.error(f"Error filtering strategic imperatives: {e}")
         return []
 
-def generate_ai_output(customized_result, selected_differentiators):
+_NA_OUTPUT = {"description": "N/A", "cost": "N/A", "timeframe": "N/A"}
+
+# Bound concurrent OpenAI calls and retry transient failures with jittered
+# exponential backoff, so fan-out never trips rate limits into hard errors.
+# The semaphore is passed in rather than module-level because asyncio
+# primitives bind to the loop they are first used on.
+async def _chat_completion(client, sem, **kwargs):
+    async with sem:
+        for attempt in range(3):
+            try:
+                return await client.chat.completions.create(**kwargs)
+            except (RateLimitError, APIConnectionError):
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(2 ** attempt + random.random())
+
+def build_prompt(customized_result, selected_differentiators):
     """
-    Uses the OpenAI API to generate a 2-3 sentence description, estimated cost, and timeframe.
-    Returns a dictionary with keys: description, cost, and timeframe.
+    Builds the per-strategy prompt asking for a JSON object with keys
+    "description", "cost", and "timeframe".
     """
     differentiators_text = ", ".join(selected_differentiators) if selected_differentiators else "None"
-    prompt = f"""
-You are an expert pharmaceutical marketing strategist.
-Given the following strategy description: "{customized_result}"
-and the selected product differentiators: "{differentiators_text}",
-please provide a short 2-3 sentence description of the strategic recommendation.
-Also, provide an estimated cost range in USD and an estimated timeframe in months for implementation.
-Return the output as a JSON object with keys "description", "cost", and "timeframe".
+    return f"""
+Given the strategy "{customized_result}" and the product differentiators "{differentiators_text}",
+provide a 2-3 sentence description of the strategic recommendation, an estimated cost range in USD,
+and an estimated timeframe in months.
+Return JSON with keys "description", "cost", and "timeframe".
+    """
+
+async def generate_ai_output(client, sem, prompt):
+    """
+    Issues one OpenAI request and returns a dictionary with keys:
+    description, cost, and timeframe.
     """
     try:
-        with st.spinner("Generating AI output..."):
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are an expert pharmaceutical marketing strategist."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-            )
+        response = await _chat_completion(
+            client,
+            sem,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You are an expert pharmaceutical marketing strategist."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=200,
+            response_format={"type": "json_object"},
+        )
         content = response.choices[0].message.content.strip()
-        try:
-            output = json.loads(content)
-        except json.JSONDecodeError:
-            st.error("Error decoding AI response. Please try again.")
-            output = {"description": "N/A", "cost": "N/A", "timeframe": "N/A"}
-        return output
+        # JSON mode guarantees well-formed JSON, so no decode fallback is needed.
+        return json.loads(content)
     except Exception as e:
         st.error(f"Error generating AI output: {e}")
-        return {"description": "N/A", "cost": "N/A", "timeframe": "N/A"}
+        return None
+
+_AI_CACHE_TTL = 86400
+
+@st.cache_resource
+def _ai_output_cache():
+    """Process-wide {prompt: (timestamp, output)} memo so identical generations are free."""
+    return {}
+
+def _cached_ai_output(cache, prompt):
+    entry = cache.get(prompt)
+    if entry is None:
+        return None
+    timestamp, ai_output = entry
+    if time.time() - timestamp > _AI_CACHE_TTL:
+        del cache[prompt]
+        return None
+    return ai_output
+
+def render_ai_output(customized_result, ai_output):
+    """Formats one strategy's AI output as a markdown block for its slot."""
+    return (
+        f"### {customized_result}\n\n"
+        f"{ai_output.get('description', 'No description available.')}\n\n"
+        f"**Estimated Cost:** {ai_output.get('cost', 'N/A')}\n\n"
+        f"**Estimated Timeframe:** {ai_output.get('timeframe', 'N/A')}"
+    )
+
+def generate_and_stream(customized_results, prompts, slots):
+    """
+    Dispatches all uncached prompts concurrently and fills each strategy's
+    slot as its response lands, so perceived latency is the fastest call
+    rather than the slowest. Cached prompts render immediately.
+    """
+    cache = _ai_output_cache()
+    # Overlapping sheet3 rows can yield identical prompts; dispatch each unique
+    # prompt once and fan the response out to every slot that shares it.
+    pending = {}
+    for i, prompt in enumerate(prompts):
+        cached = _cached_ai_output(cache, prompt)
+        if cached is not None:
+            slots[i].markdown(render_ai_output(customized_results[i], cached))
+        else:
+            pending.setdefault(prompt, []).append(i)
+
+    if not pending:
+        return
+
+    async def runner():
+        async with _make_http_client() as http_client:
+            client = AsyncOpenAI(api_key=openai_api_key, http_client=http_client)
+            sem = asyncio.Semaphore(10)
+
+            async def _one(prompt, indices):
+                return prompt, indices, await generate_ai_output(client, sem, prompt)
+
+            for coro in asyncio.as_completed([_one(p, idxs) for p, idxs in pending.items()]):
+                prompt, indices, ai_output = await coro
+                if ai_output is None:
+                    # Render the fallback but never memoize a failure, so a
+                    # re-click retries instead of pinning N/A for the day.
+                    ai_output = dict(_NA_OUTPUT)
+                else:
+                    cache[prompt] = (time.time(), ai_output)
+                for i in indices:
+                    slots[i].markdown(render_ai_output(customized_results[i], ai_output))
+
+    asyncio.run(runner())
 
 # -----------------------
 # Build the Streamlit Interface
@@ -123,7 +312,7 @@ journey_selected = st.selectbox("Select the customer journey focus", journey_opt
 
 # Step 2: Strategic Imperatives
 st.header("Step 2: Select Strategic Imperatives")
-strategic_options = filter_strategic_imperatives(sheet1, role_selected, lifecycle_selected, journey_selected)
+strategic_options = filter_strategic_imperatives(role_selected, lifecycle_selected, journey_selected)
 if not strategic_options:
     st.warning("No strategic imperatives found for these selections. Please try different options.")
 else:
@@ -135,7 +324,11 @@ if "Product Differentiators" not in sheet2.columns:
     st.error("Sheet2 must have a column named 'Product Differentiators'.")
     st.stop()
 
-product_diff_options = sheet2["Product Differentiators"].dropna().unique().tolist()
+@st.cache_data
+def unique_product_differentiators(df):
+    return df["Product Differentiators"].dropna().unique().tolist()
+
+product_diff_options = unique_product_differentiators(sheet2)
 selected_differentiators = st.multiselect("Select up to 3 Product Differentiators", options=product_diff_options, max_selections=3)
 
 # Generate and Display Results
@@ -148,18 +341,17 @@ if st.button("Generate Strategy"):
             st.error("Sheet3 must have columns named 'Strategic Imperative' and 'Result'.")
             st.stop()
         
-        results_df = sheet3[sheet3["Strategic Imperative"].isin(selected_strategics)]
-        if results_df.empty:
+        base_results = [r for imp in selected_strategics for r in imp_to_results.get(imp, [])]
+        if not base_results:
             st.info("No results found for the selected strategic imperatives.")
         else:
-            for idx, row in results_df.iterrows():
-                base_result = row["Result"]
-                differentiators_text = ", ".join(selected_differentiators) if selected_differentiators else ""
-                customized_result = base_result
-                if differentiators_text:
-                    customized_result += f" (Customized with: {differentiators_text})"
-                ai_output = generate_ai_output(customized_result, selected_differentiators)
-                st.subheader(customized_result)
-                st.write(ai_output.get("description", "No description available."))
-                st.write(f"**Estimated Cost:** {ai_output.get('cost', 'N/A')}")
-                st.write(f"**Estimated Timeframe:** {ai_output.get('timeframe', 'N/A')}")
+            differentiators_text = ", ".join(selected_differentiators) if selected_differentiators else ""
+            if differentiators_text:
+                customized_results = [f"{r} (Customized with: {differentiators_text})" for r in base_results]
+            else:
+                customized_results = base_results
+
+            prompts = [build_prompt(cr, selected_differentiators) for cr in customized_results]
+            slots = [st.empty() for _ in customized_results]
+            with st.spinner("Generating AI output..."):
+                generate_and_stream(customized_results, prompts, slots)